@@ -2,19 +2,23 @@ import sys
 import os
 import json
 import tkinter as tk
-from tkinter import filedialog, ttk, messagebox, colorchooser
+from tkinter import filedialog, ttk, messagebox, colorchooser, simpledialog
 from tkinterdnd2 import TkinterDnD, DND_FILES
 import subprocess
+import threading
+import queue
 import winsound
 
 # Pillow is used for image manipulation
 try:
-    from PIL import Image, ImageTk, ImageDraw, ImageFilter, __version__ as PILLOW_VERSION
+    from PIL import Image, ImageTk, __version__ as PILLOW_VERSION
     Resampling = Image.Resampling
 except AttributeError:
     # For older versions of Pillow
     Resampling = Image
 
+from mask_server import IMAGE_EXTENSIONS, DEFAULT_HOST, DEFAULT_PORT, MAX_PREVIEW_SIZE, apply_mask, RemoteSession, ServerError
+
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
@@ -60,6 +64,42 @@ class ToolTip:
         if tw:
             tw.destroy()
 
+class BackgroundWorker:
+    """ Runs jobs one at a time on a background thread and hands results back on the Tk thread.
+
+    Jobs run in the order they were submitted, so a mask is always applied
+    before the preview or save queued after it.
+    """
+    def __init__(self, master, poll_interval=50):
+        self.master = master
+        self.poll_interval = poll_interval
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+        self.poll()
+
+    def submit(self, job, on_success=None, on_error=None):
+        self.jobs.put((job, on_success, on_error))
+
+    def run(self):
+        while True:
+            job, on_success, on_error = self.jobs.get()
+            try:
+                self.results.put((on_success, job()))
+            except Exception as e:
+                self.results.put((on_error, e))
+
+    def poll(self):
+        # Tk widgets may only be touched from the main thread, so callbacks run here
+        self.master.after(self.poll_interval, self.poll)
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if callback:
+                callback(value)
+
 class MaskPruner:
     def __init__(self, master):
         self.master = master
@@ -76,6 +116,9 @@ class MaskPruner:
         self.menu_bar.add_cascade(label="File", menu=self.file_menu)
         self.file_menu.add_command(label="Save Current Settings as Default", command=self.save_settings_with_feedback)
         self.file_menu.add_separator()
+        self.file_menu.add_command(label="Connect to Server...", command=self.connect_to_server)
+        self.file_menu.add_command(label="Disconnect from Server", command=self.disconnect_from_server)
+        self.file_menu.add_separator()
         self.file_menu.add_command(label="Exit", command=master.quit)
 
         # Settings Menu
@@ -197,6 +240,13 @@ class MaskPruner:
         self.image_offset_y = 0
         self.selection_radius = 256  # Default radius in pixels of the original image
         self.modification_counter = 0
+        self.remote = None # RemoteSession when acting as a thin client to a job server
+        self.displayed_lease = None # Lease whose preview is currently on the canvas
+        self.preview_generation = 0 # Bumped per preview request so stale ones are skipped
+        self.resize_job = None
+        self.keepalive_job = None
+        self.worker = BackgroundWorker(master)
+        self.server_address = f"{DEFAULT_HOST}:{DEFAULT_PORT}"
 
         # Enable drag-and-drop for the main frame
         self.main_frame.drop_target_register(DND_FILES)
@@ -238,7 +288,12 @@ class MaskPruner:
         self.status_label.config(text=message)
 
     def update_image_counter(self):
-        if not self.images:
+        if self.remote:
+            if self.remote.lease_id:
+                self.image_counter_label.config(text=f"Viewing {self.remote.index + 1} of {self.remote.total}")
+            else:
+                self.image_counter_label.config(text=f"Viewing 0 of {self.remote.total}")
+        elif not self.images:
             self.image_counter_label.config(text="Viewing 0 of 0")
         else:
             self.image_counter_label.config(text=f"Viewing {self.image_index + 1} of {len(self.images)}")
@@ -252,13 +307,27 @@ class MaskPruner:
             messagebox.showinfo(title, message)
             self.showing_popup = False
 
+    def image_size(self):
+        """Returns the (width, height) of the working image, or None if nothing is loaded."""
+        if self.remote:
+            return (self.remote.width, self.remote.height) if self.remote.lease_id else None
+        if self.current_image:
+            return self.current_image.size
+        return None
+
     def on_window_resize(self, event):
         """Redraw the image when the window is resized or state changes."""
-        if event.widget is self.master and self.current_image:
+        if event.widget is self.master and self.image_size():
             state = self.master.state()
             if state != self.last_state or event.width != self.canvas.winfo_width() or event.height != self.canvas.winfo_height():
                 self.last_state = state
-                self.display_image()
+                if self.remote:
+                    # Each redraw costs a server round trip, so wait for the resize to settle
+                    if self.resize_job:
+                        self.master.after_cancel(self.resize_job)
+                    self.resize_job = self.master.after(200, self.display_image)
+                else:
+                    self.display_image()
 
     def load_image(self):
         """Loads the current image based on self.image_index."""
@@ -280,29 +349,42 @@ class MaskPruner:
 
     def display_image(self):
         """Displays the current or modified image on the canvas, scaled to fit."""
-        image_to_display = self.modified_image if self.is_modified else self.current_image
-        if not image_to_display:
+        size = self.image_size()
+        if not size:
             return
 
-        aspect_ratio = image_to_display.width / image_to_display.height
+        source_width, source_height = size
+        aspect_ratio = source_width / source_height
         canvas_w = self.canvas.winfo_width()
         canvas_h = self.canvas.winfo_height()
 
-        if image_to_display.width / canvas_w > image_to_display.height / canvas_h:
-            self.scaled_width = canvas_w
-            self.scaled_height = int(self.scaled_width / aspect_ratio)
+        if source_width / canvas_w > source_height / canvas_h:
+            scaled_width = canvas_w
+            scaled_height = int(scaled_width / aspect_ratio)
+        else:
+            scaled_height = canvas_h
+            scaled_width = int(scaled_height * aspect_ratio)
+
+        if self.remote:
+            self.fetch_remote_preview(scaled_width, scaled_height, size)
         else:
-            self.scaled_height = canvas_h
-            self.scaled_width = int(self.scaled_height * aspect_ratio)
+            image_to_display = self.modified_image if self.is_modified else self.current_image
+            self.draw_image(image_to_display.resize((scaled_width, scaled_height), Resampling.LANCZOS), size)
 
-        self.tkimage = ImageTk.PhotoImage(image_to_display.resize((self.scaled_width, self.scaled_height), Resampling.LANCZOS))
+    def draw_image(self, preview, source_size, lease_id=None):
+        """Centers a preview that was scaled to fit the canvas and redraws the selection oval."""
+        self.scaled_width, self.scaled_height = preview.size
+        self.tkimage = ImageTk.PhotoImage(preview)
 
-        self.image_offset_x = (canvas_w - self.scaled_width) // 2
-        self.image_offset_y = (canvas_h - self.scaled_height) // 2
+        self.image_offset_x = (self.canvas.winfo_width() - self.scaled_width) // 2
+        self.image_offset_y = (self.canvas.winfo_height() - self.scaled_height) // 2
 
         self.canvas.delete("all")
         self.canvas.create_image(self.image_offset_x, self.image_offset_y, anchor="nw", image=self.tkimage)
-        self.image_scale = self.current_image.width / self.scaled_width
+        self.image_scale = source_size[0] / self.scaled_width
+        self.displayed_lease = lease_id
+        # Same limit as the mouse wheel, so the circle always fits on the image
+        self.selection_radius = min(self.selection_radius, min(source_size) / 2)
 
         scaled_radius = self.selection_radius / self.image_scale
         x, y = self.master.winfo_pointerx() - self.master.winfo_rootx(), self.master.winfo_pointery() - self.master.winfo_rooty()
@@ -310,17 +392,30 @@ class MaskPruner:
         
         self.update_image_counter()
 
+    def clear_canvas(self):
+        self.canvas.delete("all")
+        self.selection_oval = None
+        self.displayed_lease = None
+        self.update_image_counter()
+
     def rotate_image(self, angle):
         """Rotates the current image."""
-        if not self.current_image:
+        if not self.image_size():
             self.show_info_message("Information", "Please load an image first.")
             return
         
-        self.current_image = self.current_image.rotate(angle, expand=True)
-        if self.is_modified:
-            self.modified_image = self.modified_image.rotate(angle, expand=True)
+        if self.remote:
+            if not self.remote_view_ready():
+                return
+            # The canvas no longer matches the server's orientation until the new preview arrives
+            self.displayed_lease = None
+            self.run_remote(lambda session: session.rotate(angle), lambda result: self.display_image(), self.on_remote_rotate_failed)
+        else:
+            self.current_image = self.current_image.rotate(angle, expand=True)
+            if self.is_modified:
+                self.modified_image = self.modified_image.rotate(angle, expand=True)
+            self.display_image()
 
-        self.display_image()
         self.update_status(f"Image rotated by {angle} degrees")
 
     def on_mouse_move(self, event):
@@ -344,12 +439,13 @@ class MaskPruner:
 
     def on_mouse_wheel(self, event):
         """Adjusts the size of the selection oval."""
-        if self.selection_oval and self.current_image:
+        size = self.image_size()
+        if self.selection_oval and size:
             increment = 20 * (event.delta / 120)
             new_radius = self.selection_radius + increment
             
             min_radius = 20
-            max_radius_on_image = min(self.current_image.width, self.current_image.height) / 2
+            max_radius_on_image = min(size) / 2
             self.selection_radius = max(min_radius, min(new_radius, max_radius_on_image))
             
             coords = self.canvas.coords(self.selection_oval)
@@ -360,13 +456,11 @@ class MaskPruner:
 
     def apply_modification(self):
         """Applies the selected mask to the in-memory image."""
-        if not self.current_image:
+        if not self.image_size():
             self.show_info_message("Information", "Please load an image first.")
             return
-
-        if not self.is_modified:
-            self.modified_image = self.current_image.copy().convert("RGBA")
-            self.is_modified = True
+        if self.remote and not self.remote_view_ready():
+            return
 
         oval_coords = self.canvas.coords(self.selection_oval)
 
@@ -378,34 +472,18 @@ class MaskPruner:
         mask_type = self.mask_type_var.get()
         strength = self.strength_var.get()
         
-        if mask_type == "Color":
-            draw = ImageDraw.Draw(self.modified_image)
-            draw.ellipse([real_x1, real_y1, real_x2, real_y2], fill=self.mask_color)
-        else:
-            # Common setup for Mosaic and Blur
-            box = (int(real_x1), int(real_y1), int(real_x2), int(real_y2))
-            region = self.current_image.crop(box)
-
-            if mask_type == "Mosaic":
-                # Exponential scaling for more control at lower strengths. Maps strength 1-100 to pixel size ~2-128.
-                exponent = 1 + ((strength - 1) / 99.0) * 6 
-                pixel_size = int(2 ** exponent)
-                small_region = region.resize(
-                    (max(1, region.width // pixel_size), max(1, region.height // pixel_size)),
-                    Resampling.NEAREST
-                )
-                processed_region = small_region.resize(region.size, Resampling.NEAREST)
-            
-            elif mask_type == "Blur":
-                blur_radius = (strength / 100) * 40 # Max blur radius of 40
-                processed_region = region.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-
-            mask = Image.new('L', region.size, 0)
-            draw = ImageDraw.Draw(mask)
-            draw.ellipse((0, 0, region.width, region.height), fill=255)
-
-            self.modified_image.paste(processed_region, box, mask)
+        coords = (real_x1, real_y1, real_x2, real_y2)
 
+        if self.remote:
+            mask_color = self.mask_color
+            self.run_remote(lambda session: session.mask(coords, mask_type, strength, mask_color))
+            # The mask targets the lease on screen, so a Next pressed before the server answers still saves it
+            self.is_modified = True
+        else:
+            if not self.is_modified:
+                self.modified_image = self.current_image.copy().convert("RGBA")
+                self.is_modified = True
+            apply_mask(self.modified_image, self.current_image, coords, mask_type, strength, self.mask_color)
 
         if self.crop_sound_var.get():
             winsound.PlaySound(resource_path("click.wav"), winsound.SND_FILENAME | winsound.SND_ASYNC)
@@ -414,7 +492,7 @@ class MaskPruner:
         self.display_image()
 
         if self.auto_advance_var.get():
-            is_last_image = self.image_index >= len(self.images) - 1
+            is_last_image = not self.remote and self.image_index >= len(self.images) - 1
             self.load_next_image()
             if is_last_image:
                 self.show_info_message("End of Queue", "You have reached the last image and looped to the start.")
@@ -424,6 +502,10 @@ class MaskPruner:
         if not self.is_modified:
             return
 
+        if self.remote:
+            self.save_remote_image()
+            return
+
         if not self.output_folder:
             self.select_output_folder()
             if not self.output_folder:
@@ -447,7 +529,22 @@ class MaskPruner:
         self.is_modified = False
         self.modified_image = None
 
+    def save_remote_image(self):
+        """Asks the job server to save the leased image to its output folder."""
+        self.run_remote(lambda session: session.save(), self.on_remote_saved, error_title="Save Error")
+        self.is_modified = False
+
+    def on_remote_saved(self, saved_path):
+        if saved_path:
+            self.modification_counter += 1
+            self.update_modified_images_counter()
+            self.update_status(f"Saved modified image to {saved_path} on the server")
+
     def load_next_image(self):
+        if self.remote:
+            self.save_if_modified()
+            self.load_remote_image("next")
+            return
         if not self.images:
             self.show_info_message("Information", "No images loaded.")
             return
@@ -456,6 +553,10 @@ class MaskPruner:
         self.load_image()
 
     def load_previous_image(self):
+        if self.remote:
+            self.save_if_modified()
+            self.load_remote_image("prev")
+            return
         if not self.images:
             self.show_info_message("Information", "No images loaded.")
             return
@@ -463,6 +564,156 @@ class MaskPruner:
         self.image_index = (self.image_index - 1 + len(self.images)) % len(self.images)
         self.load_image()
 
+    def run_remote(self, job, on_success=None, on_error=None, error_title="Server Error"):
+        """Runs job(session) against the job server without blocking the UI.
+
+        The job is skipped if the session has moved on to another image by the
+        time it runs. Errors go to on_error, else to a dialog titled
+        error_title, or to the status bar when error_title is None.
+        """
+        session = self.remote
+        lease_id = session.lease_id
+        skipped = object()
+
+        def run():
+            if session.lease_id != lease_id:
+                return skipped
+            return job(session)
+
+        def succeeded(result):
+            if result is not skipped and on_success:
+                on_success(result)
+
+        def failed(error):
+            if isinstance(error, ServerError) and error.status == 410:
+                if session is self.remote:
+                    self.remote_lease_lost()
+            elif on_error:
+                on_error(error)
+            elif error_title:
+                messagebox.showerror(error_title, str(error))
+            else:
+                self.update_status(f"Server error: {error}")
+
+        self.worker.submit(run, succeeded, failed)
+
+    def fetch_remote_preview(self, width, height, source_size):
+        """Has the server render the working image at exactly the size we display."""
+        # Canvases beyond the server's preview limit get a smaller, still correctly scaled image
+        shrink = min(1, MAX_PREVIEW_SIZE / max(width, height))
+        width, height = max(1, int(width * shrink)), max(1, int(height * shrink))
+        self.preview_generation += 1
+        generation = self.preview_generation
+        session = self.remote
+
+        def fetch(session):
+            if generation != self.preview_generation:
+                return None # A newer preview has been requested since
+            return session.lease_id, session.preview(width, height)
+
+        def show(result):
+            if result and session is self.remote and result[0] == session.lease_id:
+                self.draw_image(result[1], source_size, result[0])
+
+        self.run_remote(fetch, show, error_title=None)
+
+    def remote_lease_lost(self):
+        """Clears the image after the server reclaimed its lease."""
+        self.is_modified = False
+        self.clear_canvas()
+        self.show_info_message("Lease Expired", "The server reclaimed this image and its unsaved masks were lost.\nPress Next to continue.")
+
+    def remote_view_ready(self):
+        """Returns True if clicks on the canvas map onto the server's current image."""
+        if self.displayed_lease is not None and self.displayed_lease == self.remote.lease_id:
+            return True
+        self.update_status("Waiting for the server to update the image...")
+        return False
+
+    def on_remote_rotate_failed(self, error):
+        messagebox.showerror("Server Error", str(error))
+        # Redraw so the canvas matches whatever orientation the server has
+        self.display_image()
+
+    def schedule_lease_renewal(self, session):
+        """Renews the lease every third of its timeout so it is not reclaimed from an idle operator."""
+        if self.keepalive_job:
+            self.master.after_cancel(self.keepalive_job)
+        self.keepalive_job = self.master.after(int(session.lease_timeout / 3 * 1000), lambda: self.renew_remote_lease(session))
+
+    def renew_remote_lease(self, session):
+        self.keepalive_job = None
+        if session is not self.remote or not session.lease_id:
+            return
+        self.run_remote(lambda session: session.renew(), error_title=None)
+        self.schedule_lease_renewal(session)
+
+    def load_remote_image(self, direction):
+        """Leases the next or previous free image from the job server and shows it."""
+        session = self.remote
+
+        def loaded(found):
+            if session is not self.remote:
+                return
+            if not found:
+                self.clear_canvas()
+                self.show_info_message("End of Queue", "No more images are available on the server.")
+                return
+            self.schedule_lease_renewal(session)
+            self.display_image()
+            self.update_status(f"Loaded: {session.name}")
+
+        def failed(error):
+            if session is self.remote:
+                self.clear_canvas()
+            messagebox.showerror("Server Error", str(error))
+
+        self.modified_image = None
+        self.is_modified = False
+        # Clicks on the outgoing image must not reach the next one
+        self.displayed_lease = None
+        self.run_remote(lambda session: session.acquire(direction), loaded, failed)
+
+    def connect_to_server(self):
+        """Switches to thin-client mode, leasing images from a MaskPruner job server."""
+        address = simpledialog.askstring("Connect to Server", "Job server address (host:port):", initialvalue=self.server_address, parent=self.master)
+        if not address:
+            self.update_status("Server connection cancelled.")
+            return
+        session = RemoteSession(address.strip())
+        self.update_status(f"Connecting to {session.address}...")
+        self.worker.submit(session.status, lambda status: self.on_server_connected(session, status),
+                           lambda error: messagebox.showerror("Connection Error", str(error)))
+
+    def on_server_connected(self, session, status):
+        self.save_if_modified()
+        self.release_remote()
+        self.remote = session
+        self.server_address = session.address
+        self.images = []
+        self.current_image = None
+        self.clear_canvas()
+        self.load_remote_image("next")
+        self.update_status(f"Connected to {session.address}: {status['done']} of {status['total']} images done")
+
+    def disconnect_from_server(self):
+        """Saves pending work, hands the leased image back and returns to local mode."""
+        if not self.remote:
+            self.update_status("Not connected to a server.")
+            return
+        # Queued requests keep their session, so they still finish after the switch
+        self.save_if_modified()
+        self.release_remote()
+        self.remote = None
+        self.clear_canvas()
+        self.update_status("Disconnected from server.")
+
+    def release_remote(self):
+        """Gives the leased image back to the server queue, if any."""
+        if not self.remote:
+            return
+        self.run_remote(lambda session: session.release(), error_title=None)
+
     def select_input_folder(self):
         selected_folder = filedialog.askdirectory(title="Select Input Folder", initialdir=self.folder_path or None)
         if selected_folder:
@@ -495,7 +746,9 @@ class MaskPruner:
         """Loads all valid image files from the selected folder."""
         if not self.folder_path:
             return
-        self.images = [os.path.join(self.folder_path, f) for f in os.listdir(self.folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+        if self.remote:
+            self.disconnect_from_server()
+        self.images = [os.path.join(self.folder_path, f) for f in os.listdir(self.folder_path) if f.lower().endswith(IMAGE_EXTENSIONS)]
         if not self.images:
             messagebox.showerror("Error", "No valid images found in the selected directory.")
             return
@@ -505,7 +758,9 @@ class MaskPruner:
 
     def load_images_from_list(self, file_list):
         """Loads images from a list of file paths (e.g., from drag-and-drop)."""
-        self.images = [f for f in file_list if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+        if self.remote:
+            self.disconnect_from_server()
+        self.images = [f for f in file_list if f.lower().endswith(IMAGE_EXTENSIONS)]
         if not self.images:
             messagebox.showerror("Error", "No valid images found in the dropped files.")
             return
@@ -554,7 +809,7 @@ class MaskPruner:
             "auto_advance": False, "crop_sound": True,
             "input_folder": "", "output_folder": "",
             "mask_type": "Color", "mask_color": "#000000",
-            "strength": 50
+            "strength": 50, "server_address": f"{DEFAULT_HOST}:{DEFAULT_PORT}"
         }
         try:
             if os.path.exists(self.settings_path):
@@ -575,6 +830,7 @@ class MaskPruner:
         self.mask_color = self.settings.get("mask_color", "#000000")
         self.color_swatch.config(bg=self.mask_color)
         self.strength_var.set(self.settings.get("strength", 50))
+        self.server_address = self.settings.get("server_address", self.server_address)
 
         self.update_mask_controls()
 
@@ -587,7 +843,8 @@ class MaskPruner:
             "output_folder": self.output_folder or "",
             "mask_type": self.mask_type_var.get(),
             "mask_color": self.mask_color,
-            "strength": self.strength_var.get()
+            "strength": self.strength_var.get(),
+            "server_address": self.server_address
         }
         try:
             with open(self.settings_path, "w") as f:
@@ -603,8 +860,10 @@ class MaskPruner:
     def on_close(self):
         """Handles application close event."""
         self.save_if_modified()
+        self.release_remote()
         self.save_settings()
-        self.master.destroy()
+        # Let queued server requests finish before the window goes away
+        self.worker.submit(lambda: None, lambda result: self.master.destroy(), lambda error: self.master.destroy())
 
 def main():
     root = TkinterDnD.Tk()
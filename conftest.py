@@ -0,0 +1 @@
+# Lets a plain `pytest` run import the top-level modules from the tests folder.
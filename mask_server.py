@@ -0,0 +1,616 @@
+"""Local job server so several MaskPruner front-ends can share one render backend.
+
+Start it from a console with ``python mask_server.py --input DIR --output DIR``;
+it prints the address it listens on and stops on Ctrl-C. The windowed
+MaskPruner build has no console, so it does not run the server. Clients lease
+images from the shared queue, fetch previews at the size they need, submit mask
+operations and save, while all decoding, masking and encoding happens on the
+server.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# Pillow is used for image manipulation
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFilter
+    Resampling = Image.Resampling
+except AttributeError:
+    # For older versions of Pillow
+    Resampling = Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+MASK_TYPES = ("Color", "Mosaic", "Blur")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_PREVIEW_SIZE = 4096 # Largest preview edge the server will render
+
+def apply_mask(target, source, coords, mask_type, strength, color):
+    """Draws a circular mask bounded by coords (x1, y1, x2, y2) onto target.
+
+    Mosaic and Blur sample their pixels from source so repeated clicks do not
+    compound on already masked areas.
+    """
+    if mask_type == "Color":
+        draw = ImageDraw.Draw(target)
+        draw.ellipse(list(coords), fill=color)
+        return
+
+    # Common setup for Mosaic and Blur
+    box = tuple(int(c) for c in coords)
+    region = source.crop(box)
+
+    if mask_type == "Mosaic":
+        # Exponential scaling for more control at lower strengths. Maps strength 1-100 to pixel size ~2-128.
+        exponent = 1 + ((strength - 1) / 99.0) * 6
+        pixel_size = int(2 ** exponent)
+        small_region = region.resize(
+            (max(1, region.width // pixel_size), max(1, region.height // pixel_size)),
+            Resampling.NEAREST
+        )
+        processed_region = small_region.resize(region.size, Resampling.NEAREST)
+    elif mask_type == "Blur":
+        blur_radius = (strength / 100) * 40 # Max blur radius of 40
+        processed_region = region.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+    else:
+        raise ValueError(f"Unknown mask type: {mask_type}")
+
+    mask = Image.new('L', region.size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, region.width, region.height), fill=255)
+
+    target.paste(processed_region, box, mask)
+
+class JobError(Exception):
+    """ A request the job server refuses, carrying the HTTP status to report. """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ImageCache:
+    """ Thread-safe LRU cache of decoded source images shared by all clients.
+
+    Entries are futures from the worker pool, so a prefetch and a lease asking
+    for the same file only decode it once. Cached images are never modified.
+    """
+    def __init__(self, pool, capacity):
+        self.pool = pool
+        self.capacity = max(1, capacity)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the decoded image, waiting for the worker pool if needed."""
+        future = self.prefetch(path)
+        try:
+            return future.result()
+        except Exception:
+            with self.lock:
+                if self.entries.get(path) is future:
+                    del self.entries[path]
+            raise
+
+    def prefetch(self, path):
+        """Starts decoding path in the background unless it is already cached."""
+        with self.lock:
+            future = self.entries.get(path)
+            if future is None:
+                future = self.pool.submit(self.decode, path)
+                self.entries[path] = future
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            return future
+
+    @staticmethod
+    def decode(path):
+        image = Image.open(path)
+        image.load()
+        return image
+
+class Lease:
+    """ An image checked out to a single client, together with its unsaved edits. """
+    def __init__(self, client_id, index, path):
+        self.lease_id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.index = index
+        self.path = path
+        self.source = None # Decoded (and possibly rotated) original
+        self.modified = None # RGBA copy with masks applied, created on the first mask
+        self.angle = 0 # Total rotation applied to source, so a saved output can be reopened; None if unknown
+        self.expires = 0
+        self.lock = threading.Lock() # Serializes operations on this lease
+
+    def renew(self, timeout):
+        self.expires = time.monotonic() + timeout
+
+class JobServer:
+    """ Shared image queue, lease table and worker pool behind the HTTP front end. """
+    def __init__(self, input_folder, output_folder, workers=4, cache_size=32, lease_timeout=600):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.images = sorted(os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+        os.makedirs(output_folder, exist_ok=True)
+
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cache = ImageCache(self.pool, cache_size)
+        self.lease_timeout = lease_timeout
+
+        self.leases = {} # lease_id -> Lease
+        self.client_leases = {} # client_id -> lease_id, one lease per client
+        self.cursors = {} # client_id -> index of the last image leased
+        self.visited = {} # client_id -> indexes that client has leased, the only ones "prev" returns to
+        self.done = set() # Indexes of images saved or passed over with "next"
+        self.saved = {} # index -> rotation of its output, or None if written before this server started
+        self.lock = threading.Lock()
+
+        # Outputs from an earlier run are finished work; never overwrite them from the original
+        for index, path in enumerate(self.images):
+            if os.path.exists(self.output_path(path)):
+                self.done.add(index)
+                self.saved[index] = None
+
+    def status(self):
+        with self.lock:
+            self.expire_leases()
+            return {"total": len(self.images), "done": len(self.done), "leased": len(self.leases)}
+
+    def acquire(self, client_id, direction="next"):
+        """Leases the next free image for client_id, releasing the one it held.
+
+        Moving forward marks the previous image as done so nobody else is
+        handed it again; moving back does not. Returns None once nothing is free.
+        """
+        if direction not in ("next", "prev"):
+            raise JobError(400, f"Unknown direction: {direction}")
+
+        with self.lock:
+            self.expire_leases()
+            previous = self.drop_client_lease(client_id)
+            if previous and direction == "next":
+                self.done.add(previous.index)
+            index = self.find_free_index(client_id, direction)
+            if index is None:
+                return None
+            lease = Lease(client_id, index, self.images[index])
+            lease.renew(self.lease_timeout)
+            self.leases[lease.lease_id] = lease
+            self.client_leases[client_id] = lease.lease_id
+            self.cursors[client_id] = index
+            self.visited.setdefault(client_id, set()).add(index)
+            upcoming = self.find_free_index(client_id, direction)
+            reopen = index in self.saved
+            saved_angle = self.saved.get(index)
+
+        try:
+            lease.source = self.cache.get(lease.path)
+        except (IOError, OSError):
+            with self.lock:
+                # The client may already hold a newer lease from a later request
+                if self.client_leases.get(client_id) == lease.lease_id:
+                    self.drop_client_lease(client_id)
+                # Skip unreadable files instead of handing them out forever
+                self.done.add(index)
+            raise JobError(500, f"Failed to load image: {os.path.basename(lease.path)}")
+
+        if reopen:
+            # Reopen the saved output so earlier masks are kept rather than overwritten
+            self.pool.submit(self.reopen_output, lease, saved_angle).result()
+
+        if upcoming is not None and upcoming != index:
+            self.cache.prefetch(self.images[upcoming])
+        return lease
+
+    def get_lease(self, lease_id):
+        with self.lock:
+            self.expire_leases()
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                raise JobError(410, "Lease expired or unknown. Load another image to continue.")
+            lease.renew(self.lease_timeout)
+            return lease
+
+    def renew(self, lease_id):
+        """Keeps a lease alive while its client is idle."""
+        self.get_lease(lease_id)
+
+    def release(self, lease_id):
+        """Gives an image back to the queue without marking it done."""
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease:
+                self.drop_client_lease(lease.client_id)
+
+    def preview(self, lease, width, height):
+        """Renders the working image at width x height and returns JPEG bytes."""
+        with lease.lock:
+            image = lease.modified if lease.modified is not None else lease.source
+            return self.pool.submit(self.render_preview, image, width, height).result()
+
+    def mask(self, lease, coords, mask_type, strength, color):
+        """Applies a mask, rejecting boxes larger than the UI's selection circle allows."""
+        with lease.lock:
+            width, height = lease.source.size
+            # The UI keeps the circle on the image with a radius of at most min(size) / 2,
+            # plus a little room for rounding in its canvas-to-image conversion
+            slack = 2 + max(width, height) * 0.01
+            x1, y1, x2, y2 = coords
+            if x2 - x1 > min(width, height) + slack or y2 - y1 > min(width, height) + slack:
+                raise JobError(400, "Mask box is larger than the image allows.")
+            if x1 < -slack or y1 < -slack or x2 > width + slack or y2 > height + slack:
+                raise JobError(400, "Mask box lies outside the image.")
+            self.pool.submit(self.render_mask, lease, coords, mask_type, strength, color).result()
+
+    def rotate(self, lease, angle):
+        with lease.lock:
+            self.pool.submit(self.render_rotation, lease, angle).result()
+
+    def save(self, lease):
+        """Writes the masked image to the output folder and marks it done.
+
+        Returns the saved path, or None if the image has no masks applied.
+        """
+        with lease.lock:
+            if lease.modified is None:
+                return None
+            modified_filepath = self.output_path(lease.path)
+            self.pool.submit(self.encode_png, lease.modified, modified_filepath).result()
+            angle = lease.angle
+        with self.lock:
+            self.done.add(lease.index)
+            self.saved[lease.index] = angle
+        return modified_filepath
+
+    def output_path(self, path):
+        filename, ext = os.path.splitext(os.path.basename(path))
+        return os.path.join(self.output_folder, f"{filename}.png")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+    # --- Helpers below expect self.lock to be held ---
+
+    def expire_leases(self):
+        now = time.monotonic()
+        for lease in [lease for lease in self.leases.values() if lease.expires < now]:
+            self.drop_client_lease(lease.client_id)
+
+    def drop_client_lease(self, client_id):
+        lease_id = self.client_leases.pop(client_id, None)
+        return self.leases.pop(lease_id, None) if lease_id else None
+
+    def find_free_index(self, client_id, direction):
+        """Walks the queue from the client's cursor, skipping leased images.
+
+        "next" skips done images; "prev" only returns to images this client
+        has leased before, so it never lands on another operator's work.
+        """
+        count = len(self.images)
+        step = 1 if direction == "next" else -1
+        start = self.cursors.get(client_id, -1 if step == 1 else 0)
+        taken = {lease.index for lease in self.leases.values()}
+        visited = self.visited.get(client_id, set())
+        for offset in range(1, count + 1):
+            index = (start + step * offset) % count
+            if index in taken:
+                continue
+            if (step == 1 and index in self.done) or (step == -1 and index not in visited):
+                continue
+            return index
+        return None
+
+    # --- Worker pool jobs ---
+
+    @staticmethod
+    def render_preview(image, width, height):
+        buffer = io.BytesIO()
+        image.resize((width, height), Resampling.LANCZOS).convert("RGB").save(buffer, "JPEG", quality=90)
+        return buffer.getvalue()
+
+    @staticmethod
+    def render_mask(lease, coords, mask_type, strength, color):
+        if lease.modified is None:
+            lease.modified = lease.source.copy().convert("RGBA")
+        apply_mask(lease.modified, lease.source, coords, mask_type, strength, color)
+
+    @staticmethod
+    def render_rotation(lease, angle):
+        lease.source = lease.source.rotate(angle, expand=True)
+        if lease.angle is not None:
+            lease.angle = (lease.angle + angle) % 360
+        if lease.modified is not None:
+            lease.modified = lease.modified.rotate(angle, expand=True)
+
+    def reopen_output(self, lease, angle):
+        try:
+            output = ImageCache.decode(self.output_path(lease.path))
+        except (IOError, OSError):
+            return
+        if angle is None:
+            # Rotation of an older output is unknown, so work from the output itself
+            lease.source = output
+        elif angle:
+            lease.source = lease.source.rotate(angle, expand=True)
+        lease.angle = angle
+        lease.modified = output.convert("RGBA")
+
+    @staticmethod
+    def encode_png(image, path):
+        image.convert("RGB").save(path, "PNG")
+
+def lease_info(lease, jobs):
+    return {
+        "lease": lease.lease_id,
+        "name": os.path.basename(lease.path),
+        "index": lease.index,
+        "total": len(jobs.images),
+        "width": lease.source.width,
+        "height": lease.source.height,
+        "timeout": jobs.lease_timeout,
+    }
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """ JSON-over-HTTP front end for a JobServer stored on the server as ``jobs``. """
+    server_version = "MaskPrunerServer"
+
+    def do_GET(self):
+        self.dispatch({"/status": self.handle_status, "/preview": self.handle_preview})
+
+    def do_POST(self):
+        self.dispatch({
+            "/lease": self.handle_lease, "/mask": self.handle_mask, "/rotate": self.handle_rotate,
+            "/save": self.handle_save, "/renew": self.handle_renew, "/release": self.handle_release,
+        })
+
+    def dispatch(self, routes):
+        url = urlparse(self.path)
+        handler = routes.get(url.path)
+        try:
+            if handler is None:
+                raise JobError(404, f"Unknown endpoint: {url.path}")
+            handler(self.server.jobs, parse_qs(url.query))
+        except JobError as e:
+            self.send_json({"error": str(e)}, e.status)
+        except Exception as e:
+            self.send_json({"error": f"{type(e).__name__}: {e}"}, 500)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            raise JobError(400, "Request body is not valid JSON.")
+        if not isinstance(payload, dict):
+            raise JobError(400, "Request body must be a JSON object.")
+        return payload
+
+    def send_json(self, payload, status=200):
+        self.send_body(json.dumps(payload).encode("utf-8"), "application/json", status)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Frozen windowed builds have no stderr to log to
+        if sys.stderr:
+            super().log_message(format, *args)
+
+    def handle_status(self, jobs, query):
+        self.send_json(jobs.status())
+
+    def handle_preview(self, jobs, query):
+        lease = jobs.get_lease(query.get("lease", [""])[0])
+        try:
+            width = int(query["width"][0])
+            height = int(query["height"][0])
+        except (KeyError, ValueError):
+            raise JobError(400, "Preview needs integer width and height.")
+        if not (1 <= width <= MAX_PREVIEW_SIZE and 1 <= height <= MAX_PREVIEW_SIZE):
+            raise JobError(400, f"Preview width and height must be between 1 and {MAX_PREVIEW_SIZE}.")
+        self.send_body(jobs.preview(lease, width, height), "image/jpeg")
+
+    def handle_lease(self, jobs, query):
+        payload = self.read_json()
+        client_id = payload.get("client")
+        if not client_id or not isinstance(client_id, str):
+            raise JobError(400, "Missing client id.")
+        lease = jobs.acquire(client_id, payload.get("direction", "next"))
+        self.send_json(lease_info(lease, jobs) if lease else {"lease": None, "total": len(jobs.images)})
+
+    def handle_mask(self, jobs, query):
+        payload = self.read_json()
+        lease = jobs.get_lease(payload.get("lease"))
+        mask_type = payload.get("mask_type")
+        if mask_type not in MASK_TYPES:
+            raise JobError(400, f"Unknown mask type: {mask_type}")
+        try:
+            coords = [float(c) for c in payload["box"]]
+            strength = min(100, max(1, int(payload.get("strength", 50))))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise JobError(400, "Mask needs a numeric box and strength.")
+        if not all(math.isfinite(c) for c in coords):
+            raise JobError(400, "Mask box coordinates must be finite.")
+        if len(coords) != 4 or coords[0] >= coords[2] or coords[1] >= coords[3]:
+            raise JobError(400, "Mask box must be [x1, y1, x2, y2] with x1 < x2 and y1 < y2.")
+        color = payload.get("color", "#000000")
+        try:
+            ImageColor.getrgb(color)
+        except (ValueError, TypeError, AttributeError):
+            raise JobError(400, f"Unknown mask color: {color}")
+        jobs.mask(lease, coords, mask_type, strength, color)
+        self.send_json({})
+
+    def handle_rotate(self, jobs, query):
+        payload = self.read_json()
+        lease = jobs.get_lease(payload.get("lease"))
+        try:
+            angle = int(payload["angle"])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise JobError(400, "Rotate needs an integer angle.")
+        if angle % 90:
+            raise JobError(400, "Rotate angle must be a multiple of 90 degrees.")
+        jobs.rotate(lease, angle)
+        self.send_json({"width": lease.source.width, "height": lease.source.height})
+
+    def handle_save(self, jobs, query):
+        lease = jobs.get_lease(self.read_json().get("lease"))
+        self.send_json({"saved": jobs.save(lease)})
+
+    def handle_renew(self, jobs, query):
+        jobs.renew(self.read_json().get("lease"))
+        self.send_json({})
+
+    def handle_release(self, jobs, query):
+        jobs.release(self.read_json().get("lease"))
+        self.send_json({})
+
+class ServerError(Exception):
+    """ Raised by RemoteSession when the job server is unreachable or rejects a request.
+
+    status is the HTTP status the server answered with, or None if it never answered.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class RemoteSession:
+    """ Thin-client connection the Tk UI uses to work against a job server.
+
+    Holds at most one lease at a time; name, index, total, width and height
+    describe the leased image.
+    """
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.base_url = address if address.startswith("http") else f"http://{address}"
+        self.timeout = timeout
+        self.client_id = uuid.uuid4().hex
+        self.lease_id = None
+        self.name = None
+        self.index = 0
+        self.total = 0
+        self.width = 0
+        self.height = 0
+        self.lease_timeout = 0
+
+    def request(self, path, payload=None, query=None):
+        url = self.base_url.rstrip("/") + path
+        if query:
+            url += "?" + urlencode(query)
+        data = None
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except (ValueError, AttributeError):
+                message = e.reason
+            if e.code == 410:
+                self.lease_id = None
+            raise ServerError(message, e.code)
+        except (urllib.error.URLError, OSError) as e:
+            raise ServerError(f"Cannot reach server at {self.address}: {getattr(e, 'reason', e)}")
+
+    def call(self, path, payload=None):
+        return json.loads(self.request(path, payload))
+
+    def status(self):
+        return self.call("/status")
+
+    def acquire(self, direction="next"):
+        """Leases the next free image in direction. Returns False when the queue is exhausted."""
+        # The server drops the old lease even if this call fails
+        self.lease_id = None
+        self.name = None
+        self.width = self.height = 0
+        info = self.call("/lease", {"client": self.client_id, "direction": direction})
+        self.lease_id = info["lease"]
+        self.total = info["total"]
+        if not self.lease_id:
+            self.name = None
+            return False
+        self.name = info["name"]
+        self.index = info["index"]
+        self.width = info["width"]
+        self.height = info["height"]
+        self.lease_timeout = info["timeout"]
+        return True
+
+    def preview(self, width, height):
+        if not self.lease_id:
+            raise ServerError("No image is leased.")
+        data = self.request("/preview", query={"lease": self.lease_id, "width": width, "height": height})
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def mask(self, coords, mask_type, strength, color):
+        self.call("/mask", {"lease": self.lease_id, "box": list(coords), "mask_type": mask_type, "strength": strength, "color": color})
+
+    def rotate(self, angle):
+        size = self.call("/rotate", {"lease": self.lease_id, "angle": angle})
+        self.width = size["width"]
+        self.height = size["height"]
+
+    def save(self):
+        return self.call("/save", {"lease": self.lease_id})["saved"]
+
+    def renew(self):
+        if self.lease_id:
+            self.call("/renew", {"lease": self.lease_id})
+
+    def release(self):
+        if self.lease_id:
+            self.call("/release", {"lease": self.lease_id})
+            self.lease_id = None
+
+def positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0: {value}")
+    return number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a shared MaskPruner image queue to thin clients.")
+    parser.add_argument("--input", required=True, help="Folder of images to hand out")
+    parser.add_argument("--output", required=True, help="Folder to save masked images to")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Render worker threads")
+    parser.add_argument("--cache-size", type=int, default=32, help="Decoded images kept in memory")
+    parser.add_argument("--lease-timeout", type=positive_float, default=600, help="Seconds before an idle lease is reclaimed")
+    args = parser.parse_args(argv)
+
+    jobs = JobServer(args.input, args.output, args.workers, args.cache_size, args.lease_timeout)
+    httpd = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+    httpd.jobs = jobs
+    print(f"Serving {len(jobs.images)} images from {args.input} on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        jobs.shutdown()
+
+if __name__ == "__main__":
+    main()
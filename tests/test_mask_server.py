@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+
+from PIL import Image
+
+from mask_server import JobError, JobRequestHandler, JobServer, RemoteSession, ServerError
+
+class QuietHandler(JobRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class JobServerTestCase(unittest.TestCase):
+    """ Runs a JobServer over a temporary folder of small generated images. """
+    image_count = 3
+    lease_timeout = 600
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.input_folder = os.path.join(self.folder, "in")
+        self.output_folder = os.path.join(self.folder, "out")
+        os.makedirs(self.input_folder)
+        for i in range(self.image_count):
+            Image.new("RGB", (40, 30), (i * 80, 100, 50)).save(os.path.join(self.input_folder, f"img{i}.png"))
+        self.jobs = JobServer(self.input_folder, self.output_folder, workers=2, lease_timeout=self.lease_timeout)
+
+    def tearDown(self):
+        self.jobs.shutdown()
+        shutil.rmtree(self.folder)
+
+class QueueTest(JobServerTestCase):
+    def test_no_image_is_leased_twice(self):
+        leases = [self.jobs.acquire(f"client{i}") for i in range(self.image_count)]
+        self.assertEqual(sorted(lease.index for lease in leases), list(range(self.image_count)))
+        self.assertIsNone(self.jobs.acquire("late"))
+
+    def test_prev_does_not_revisit_a_lease_held_by_someone_else(self):
+        a = self.jobs.acquire("a")
+        self.jobs.acquire("b")
+        self.assertEqual(self.jobs.acquire("a", "prev").index, a.index)
+
+    def test_next_marks_done_and_prev_does_not(self):
+        first = self.jobs.acquire("a")
+        second = self.jobs.acquire("a", "next")
+        self.assertIn(first.index, self.jobs.done)
+        self.jobs.acquire("a", "prev")
+        self.assertNotIn(second.index, self.jobs.done)
+
+    def test_done_images_are_not_handed_out_again(self):
+        self.jobs.acquire("a")
+        self.jobs.acquire("a")
+        self.assertNotEqual(self.jobs.acquire("b").index, 0)
+
+    def test_prev_only_returns_to_own_images(self):
+        a = self.jobs.acquire("a")
+        self.jobs.mask(a, (0, 0, 10, 10), "Color", 50, "#ff0000")
+        self.jobs.save(a)
+        self.jobs.acquire("a")
+        b = self.jobs.acquire("b")
+        self.assertNotEqual(self.jobs.acquire("b", "prev").index, a.index)
+        self.assertEqual(self.jobs.acquire("b", "prev").index, b.index)
+
+    def test_reopening_a_saved_image_keeps_its_masks(self):
+        lease = self.jobs.acquire("a")
+        self.jobs.rotate(lease, 90)
+        self.jobs.mask(lease, (0, 0, 10, 10), "Color", 50, "#ff0000")
+        self.jobs.save(lease)
+        self.jobs.acquire("a")
+        reopened = self.jobs.acquire("a", "prev")
+        self.assertEqual(reopened.index, lease.index)
+        self.assertEqual(reopened.source.size, (30, 40))
+        self.assertEqual(reopened.modified.getpixel((5, 5))[:3], (255, 0, 0))
+
+    def test_outputs_from_an_earlier_run_are_kept(self):
+        lease = self.jobs.acquire("a")
+        self.jobs.rotate(lease, 90)
+        self.jobs.mask(lease, (0, 0, 10, 10), "Color", 50, "#ff0000")
+        saved_path = self.jobs.save(lease)
+        restarted = JobServer(self.input_folder, self.output_folder)
+        try:
+            self.assertIn(lease.index, restarted.done)
+            self.assertNotEqual(restarted.acquire("b").index, lease.index)
+            # Reached again only through the client's own history, from the saved output
+            restarted.visited["b"].add(lease.index)
+            reopened = restarted.acquire("b", "prev")
+            self.assertEqual(reopened.index, lease.index)
+            self.assertEqual(reopened.source.size, (30, 40))
+            restarted.mask(reopened, (20, 30, 30, 40), "Mosaic", 50, "#000000")
+            restarted.save(reopened)
+            self.assertEqual(Image.open(saved_path).getpixel((5, 5)), (255, 0, 0))
+        finally:
+            restarted.shutdown()
+
+    def test_unreadable_file_is_skipped(self):
+        with open(os.path.join(self.input_folder, "bad.png"), "w") as f:
+            f.write("not an image")
+        jobs = JobServer(self.input_folder, self.output_folder)
+        try:
+            with self.assertRaises(JobError) as raised:
+                jobs.acquire("a")
+            self.assertEqual(raised.exception.status, 500)
+            self.assertNotIn("a", jobs.client_leases)
+            self.assertEqual(os.path.basename(jobs.acquire("a").path), "img0.png")
+        finally:
+            jobs.shutdown()
+
+class ExpiryTest(JobServerTestCase):
+    lease_timeout = 0.5
+
+    def test_expired_lease_returns_410(self):
+        lease = self.jobs.acquire("a")
+        time.sleep(0.8)
+        with self.assertRaises(JobError) as raised:
+            self.jobs.get_lease(lease.lease_id)
+        self.assertEqual(raised.exception.status, 410)
+        self.assertEqual(self.jobs.acquire("b").index, lease.index)
+
+    def test_renew_keeps_lease_alive(self):
+        lease = self.jobs.acquire("a")
+        # Each renewal comes well inside the timeout, but together they outlast it
+        for _ in range(4):
+            time.sleep(0.2)
+            self.jobs.renew(lease.lease_id)
+        self.assertIs(self.jobs.get_lease(lease.lease_id), lease)
+
+class HttpTest(JobServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+        self.httpd.jobs = self.jobs
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.session = RemoteSession(f"127.0.0.1:{self.httpd.server_address[1]}")
+        self.session.acquire()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        super().tearDown()
+
+    def assertStatus(self, status, call, *args):
+        with self.assertRaises(ServerError) as raised:
+            call(*args)
+        self.assertEqual(raised.exception.status, status)
+
+    def test_mask_and_save(self):
+        self.session.mask((0, 0, 20, 20), "Mosaic", 50, "#000000")
+        self.assertTrue(os.path.isfile(self.session.save()))
+
+    def test_bad_mask_payloads_return_400(self):
+        self.assertStatus(400, self.session.mask, (20, 20, 10, 10), "Color", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (0, 0, 10, 10), "Color", 50, "notacolor")
+        self.assertStatus(400, self.session.mask, (0, 0, 10, 10), "Bogus", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (0, 0, 10), "Color", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (0, 0, 10, 10), "Blur", "strong", "#000000")
+        self.assertStatus(400, self.session.mask, (float("nan"), 0, 10, 10), "Mosaic", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (0, 0, float("inf"), 10), "Mosaic", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (0, 0, 12000, 12000), "Mosaic", 50, "#000000")
+        self.assertStatus(400, self.session.mask, (100, 100, 110, 110), "Mosaic", 50, "#000000")
+
+    def test_rotate_only_accepts_right_angles(self):
+        self.assertStatus(400, self.session.rotate, 45)
+        self.session.rotate(-90)
+        self.assertEqual((self.session.width, self.session.height), (30, 40))
+
+    def test_non_string_client_returns_400(self):
+        self.assertStatus(400, self.session.call, "/lease", {"client": ["a"]})
+
+    def test_oversized_preview_returns_400(self):
+        self.assertEqual(self.session.preview(20, 15).size, (20, 15))
+        self.assertStatus(400, self.session.preview, 50000, 50000)
+
+    def test_preview_without_lease_fails_locally(self):
+        self.session.release()
+        self.assertStatus(None, self.session.preview, 20, 15)
+
+if __name__ == "__main__":
+    unittest.main()